@@ -1,19 +1,38 @@
 import os
+import sys
 import glob
 import pandas as pd
 import numpy as np
 from datetime import datetime
 import clickhouse_connect
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import multiprocessing
 import time
 from tqdm import tqdm
 import psutil
 import gc
+import json
+import hashlib
+import threading
+import re
+from collections import deque
+from clickhouse_connect.driver.tools import insert_file
+from clickhouse_connect.driver.exceptions import OperationalError
 
 # 全局配置参数
 CONFIG = {
-    'batch_size': 10000,  # 增大批处理大小
+    'batch_size': 10000,  # 初始插入块大小（行），之后由 BlockSizeController 自适应调整
+    'min_block_rows': 1000,  # 块大小下限，拆分到此仍失败则放弃该文件
+    'max_block_rows': 1000000,  # 块大小上限，与服务端 max_insert_block_size 一致
+    'max_block_bytes': 256 * 1024 * 1024,  # 单块最大载荷字节数
+    'block_size_min_samples': 3,  # 每个块大小至少测量几次才参与最优块比较
+    'block_size_probe_interval': 10,  # 上限被压低后连续成功多少次放开一档上限
+    'block_size_state_file': 'import_logs/block_size.json',  # 调优后的块大小持久化文件
+    'use_spool': False,  # 启用本地落盘缓冲：解析进程只写Parquet文件，由独立的 loader 线程导入
+    'spool_dir': 'import_spool',  # 缓冲文件目录（需要 pyarrow）
+    'spool_loader_threads': 2,  # 导入缓冲文件的 loader 线程数
+    'spool_poll_interval': 1,  # 缓冲区为空时 loader 的轮询间隔（秒）
+    'dedup_window': 100000,  # 服务端插入去重窗口（块数），会永久修改表设置，影响其他写入方，详见 README；0 表示关闭
     'max_workers': 16,  # 降低并发进程数，减轻资源压力
     'ch_settings': {
         'host': 'localhost',
@@ -29,7 +48,7 @@ CONFIG = {
             'input_format_parallel_parsing': 1
         }
     },
-    'batch_cooldown': 15,  # 每批次处理后的冷却时间（秒）
+    'max_in_flight': None,  # 同时在途的任务数上限，None 表示 max_workers 的 2 倍
     'connection_retry_base_delay': 3  # 连接重试基础延迟（秒）
 }
 
@@ -37,17 +56,31 @@ CONFIG = {
 if CONFIG['max_workers'] is None:
     CONFIG['max_workers'] = max(1, min(multiprocessing.cpu_count() - 1, 16))  # 保留一个核心给操作系统
 
-BATCH_FILE_COUNT = 10000  # 每批导入文件数量，减小单批压力
+# 在途任务上限：保证每个进程完成后立即有下一个文件可处理，同时限制内存中排队的 future 数量
+if CONFIG['max_in_flight'] is None:
+    CONFIG['max_in_flight'] = CONFIG['max_workers'] * 2
 
 def get_client():
     """获取ClickHouse客户端连接"""
     return clickhouse_connect.get_client(**CONFIG['ch_settings'])
 
+# 下钻查询使用的跳数索引与投影：按 service_name / endpoint 过滤时只读取少量 granule
+TABLE_INDEXES = [
+    ('idx_service_name', 'service_name TYPE bloom_filter(0.01) GRANULARITY 4'),
+    ('idx_endpoint', 'endpoint TYPE bloom_filter(0.01) GRANULARITY 4'),
+]
+TABLE_PROJECTIONS = [
+    # 只包含下钻查询用到的列，避免整表再存一份
+    ('proj_service_endpoint', '(SELECT service_name, endpoint, timestamp, cpm, latency ORDER BY service_name, endpoint, timestamp)'),
+]
+
 def create_table():
     """创建数据表"""
     client = get_client()
     try:
-        client.command('''
+        indexes = ''.join(f",\n                INDEX {name} {definition}" for name, definition in TABLE_INDEXES)
+        projections = ''.join(f",\n                PROJECTION {name} {definition}" for name, definition in TABLE_PROJECTIONS)
+        client.command(f'''
             CREATE TABLE IF NOT EXISTS api_metrics (
                 service_name String,
                 endpoint String,
@@ -55,17 +88,34 @@ def create_table():
                 cpm Float32,
                 latency Float32,
                 query_start_time DateTime,
-                query_end_time DateTime
+                query_end_time DateTime{indexes}{projections}
             ) ENGINE = MergeTree()
             PARTITION BY toYYYYMM(timestamp)  
             ORDER BY timestamp
             SETTINGS index_granularity = 8192
         ''')
+        # 已存在的表补充索引和投影，仅对新写入的 part 生效，历史数据需执行 MATERIALIZE
+        for name, definition in TABLE_INDEXES:
+            client.command(f"ALTER TABLE api_metrics ADD INDEX IF NOT EXISTS {name} {definition}")
+        for name, definition in TABLE_PROJECTIONS:
+            client.command(f"ALTER TABLE api_metrics ADD PROJECTION IF NOT EXISTS {name} {definition}")
         print("Table created/verified successfully")
     finally:
         # 确保连接关闭
         client.close()
 
+def enable_insert_deduplication():
+    """为非复制表开启插入去重窗口，使带去重标识的块重复导入时被服务端丢弃
+
+    这是表级别的永久设置：其他不带去重标识、也未设置 insert_deduplicate=0 的写入方，
+    窗口内内容相同的块同样会被丢弃。
+    """
+    client = get_client()
+    try:
+        client.command(f"ALTER TABLE api_metrics MODIFY SETTING non_replicated_deduplication_window = {CONFIG['dedup_window']}")
+    finally:
+        client.close()
+
 def batch_parse_datetime(dt_series):
     """批量处理日期时间列"""
     def parser(x):
@@ -110,90 +160,254 @@ def process_csv(file):
         print(f"Error processing {file}: {str(e)}")
         return None
 
-def chunk_dataframe(df, chunk_size):
-    """将DataFrame分成多个块"""
-    for i in range(0, len(df), chunk_size):
-        yield df.iloc[i:i + chunk_size]
+class BlockSizeController:
+    """自适应插入块大小控制器
+
+    记录每次插入的延迟、载荷字节数和错误类型：吞吐提升时块大小翻倍，
+    吞吐下降时退回到最优块大小；服务端拒绝或超时时对半拆分。
+    被压低的上限在连续成功若干次后逐步放开，重新探测更大的块。
+    """
+
+    def __init__(self, block_size):
+        self.min_rows = CONFIG['min_block_rows']
+        self.max_rows = CONFIG['max_block_rows']
+        self.block_size = max(self.min_rows, min(int(block_size), self.max_rows))
+        self.ceiling = self.max_rows  # 当前允许探索的最大块大小
+        self.throughput = {}  # 块大小 -> 平滑后的吞吐（行/秒）
+        self.samples = {}  # 块大小 -> 吞吐样本数
+        self.successes_under_ceiling = 0  # 上限被压低后的连续成功次数
+        self.bytes_per_row = None
+        self.largest_insert = 0  # 观察到的最大单次插入行数
+        self.insert_count = 0
+        self.total_latency = 0.0
+        self.total_bytes = 0
+        self.errors = {}  # 错误类型 -> 次数
+
+    def record_success(self, rows, payload_bytes, latency, whole_file=False):
+        """记录一次成功插入，并根据吞吐变化调整块大小
+
+        whole_file 表示这次插入包含了整个文件：小于块大小的文件也作为样本，
+        否则文件普遍小于块大小时控制器永远得不到测量。
+        """
+        self.insert_count += 1
+        self.total_latency += latency
+        self.total_bytes += payload_bytes
+        self.largest_insert = max(self.largest_insert, rows)
+        if rows:
+            self.bytes_per_row = payload_bytes / rows
+
+        # 多块文件的尾块不足一个完整块，不能代表当前块大小的吞吐
+        size = self.block_size
+        if rows < size and not whole_file:
+            return
+
+        rate = rows / max(latency, 1e-6)
+        previous = self.throughput.get(size)
+        self.throughput[size] = rate if previous is None else previous * 0.7 + rate * 0.3
+        self.samples[size] = self.samples.get(size, 0) + 1
+
+        # 上限被压低后连续成功足够多次，放开一档上限，并丢弃更大块的旧吞吐记录以便重新测量
+        if self.ceiling < self.max_rows:
+            self.successes_under_ceiling += 1
+            if self.successes_under_ceiling >= CONFIG['block_size_probe_interval']:
+                self.ceiling = min(self.ceiling * 2, self.max_rows)
+                self.successes_under_ceiling = 0
+                self._forget_above(size)
+
+        # 样本不足时继续在当前块大小测量，避免单次抖动决定方向
+        if self.samples[size] < CONFIG['block_size_min_samples']:
+            return
+
+        measured = {s: r for s, r in self.throughput.items() if self.samples[s] >= CONFIG['block_size_min_samples']}
+        best_size = max(measured, key=measured.get)
+        if best_size == size:
+            # 当前块大小最优，继续向上探索；块大小超过最大单次插入的 2 倍没有意义，
+            # 文件普遍较小时块大小会收敛到文件大小附近
+            self.block_size = max(self.min_rows, min(size * 2, self.ceiling, self._max_rows_by_bytes(), self.largest_insert * 2))
+            if self.block_size < size:
+                self._forget_above(self.block_size)
+        elif best_size < size:
+            # 更大的块反而更慢，退回最优块大小，暂时不再超过它
+            self._lower_ceiling(best_size)
+            self.block_size = best_size
+        else:
+            self.block_size = min(best_size, self.ceiling)
+
+    def record_failure(self, kind):
+        """记录一次失败插入；超时或被服务端拒绝时块大小对半拆分
+
+        返回 False 表示已无法继续拆分。
+        """
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        if kind not in ('timeout', 'rejected'):
+            return True
+        if self.block_size <= self.min_rows:
+            return False
+        self.block_size = max(self.min_rows, self.block_size // 2)
+        self._lower_ceiling(self.block_size)
+        # 失败的块大小的吞吐记录不再可信
+        self._forget_above(self.block_size)
+        return True
+
+    def _lower_ceiling(self, ceiling):
+        """压低探索上限，并重新开始计算恢复所需的成功次数"""
+        self.ceiling = max(ceiling, self.min_rows)
+        self.successes_under_ceiling = 0
+
+    def _forget_above(self, size):
+        """丢弃大于 size 的块大小的吞吐记录"""
+        self.throughput = {s: r for s, r in self.throughput.items() if s <= size}
+        self.samples = {s: n for s, n in self.samples.items() if s <= size}
+
+    def _max_rows_by_bytes(self):
+        """按单块最大字节数限制块行数"""
+        if not self.bytes_per_row:
+            return self.max_rows
+        return max(self.min_rows, int(CONFIG['max_block_bytes'] / self.bytes_per_row))
+
+# ClickHouse 错误码分类：超时类重建连接并拆小块；资源/大小类拆小块重试；
+# 服务端繁忙类退避后原样重试（TOO_MANY_PARTS 时拆小块只会产生更多 part）；其余错误码视为数据错误，不重试
+TIMEOUT_ERROR_CODES = {159, 209, 210}  # TIMEOUT_EXCEEDED, SOCKET_TIMEOUT, NETWORK_ERROR
+REJECTED_ERROR_CODES = {241, 307, 396, 173}  # MEMORY_LIMIT_EXCEEDED, TOO_MANY_BYTES, TOO_MANY_ROWS_OR_BYTES, CANNOT_ALLOCATE_MEMORY
+BUSY_ERROR_CODES = {202, 252}  # TOO_MANY_SIMULTANEOUS_QUERIES, TOO_MANY_PARTS
+
+def classify_insert_error(e):
+    """将插入异常归类为 timeout / connection / rejected / busy / data"""
+    message = str(e)
+    # 服务端错误：新版 clickhouse_connect 在异常的 code 属性中给出错误码，
+    # 旧版只在信息中包含 "Code: NNN. DB::Exception" 或 "exception, code: NNN"
+    code = getattr(e, 'code', None)
+    if code is None:
+        match = re.search(r'\bcode:\s*(\d+)', message, re.IGNORECASE)
+        if match:
+            code = int(match.group(1))
+    if code is not None:
+        if code in TIMEOUT_ERROR_CODES:
+            return 'timeout'
+        if code in REJECTED_ERROR_CODES:
+            return 'rejected'
+        if code in BUSY_ERROR_CODES:
+            return 'busy'
+        return 'data'
+    # 没有错误码时按异常类型判断：OperationalError 为请求未完成（连接失败、读超时等）
+    if isinstance(e, (OperationalError, ConnectionError, TimeoutError)):
+        if isinstance(e, TimeoutError) or 'timed out' in message or 'Timeout' in message:
+            return 'timeout'
+        return 'connection'
+    if 'timed out' in message:
+        return 'timeout'
+    if 'Broken pipe' in message or 'Connection reset' in message or 'Connection refused' in message:
+        return 'connection'
+    # 其余为客户端序列化、类型转换等确定性错误，重试或拆分都无济于事
+    return 'data'
+
+def file_token(file):
+    """根据CSV路径、大小和修改时间生成文件标识，文件重新导出后标识随之变化"""
+    stat = os.stat(file)
+    key = f"{os.path.abspath(file)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+def load_block_size():
+    """读取上次运行调优得到的块大小，不存在时使用 batch_size"""
+    try:
+        with open(CONFIG['block_size_state_file'], 'r', encoding='utf-8') as f:
+            return int(json.load(f)['block_size'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return CONFIG['batch_size']
 
-def import_file_process(file, batch_id=0, file_index=0):
+def save_block_size(block_size):
+    """持久化调优后的块大小，供下次运行使用"""
+    state_file = CONFIG['block_size_state_file']
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'block_size': int(block_size), 'updated_at': datetime.now().isoformat()}, f)
+    os.replace(tmp_file, state_file)
+
+# 每个工作进程持有一个控制器，跨文件延续调优结果
+_block_controller = None
+
+def get_block_controller():
+    """获取当前工作进程的块大小控制器"""
+    global _block_controller
+    if _block_controller is None:
+        _block_controller = BlockSizeController(load_block_size())
+    return _block_controller
+
+def insert_adaptive(client, df, controller, token, offset=0, retry_rows=None):
+    """按控制器给出的块大小分块插入，返回已插入的行偏移
+
+    每个块带有 <文件标识>:<偏移>:<行数> 去重标识。超时和连接异常会携带已插入偏移
+    和失败块的行数抛出：服务端可能已经写入该块，重试时用 retry_rows 按相同的块边界
+    重新插入，由服务端去重，避免重复写入。
+    """
+    while offset < len(df):
+        rows = retry_rows or controller.block_size
+        retry_rows = None
+        chunk = df.iloc[offset:offset + rows]
+        payload_bytes = int(chunk.memory_usage(index=False, deep=True).sum())
+        start = time.time()
+        try:
+            client.insert_df('api_metrics', chunk, settings={
+                'insert_deduplicate': 1,
+                'insert_deduplication_token': f"{token}:{offset}:{len(chunk)}"
+            })
+        except Exception as e:
+            kind = classify_insert_error(e)
+            can_split = controller.record_failure(kind)
+            if kind == 'rejected' and can_split:
+                continue  # 服务端拒绝的块未写入，拆小后重试同一位置
+            e.inserted_offset = offset
+            e.pending_rows = len(chunk)
+            raise
+        controller.record_success(len(chunk), payload_bytes, time.time() - start,
+                                  whole_file=offset == 0 and len(chunk) == len(df))
+        offset += len(chunk)
+    return offset
+
+def import_file_process(file, file_index=0, total_files=0):
     """作为单独进程处理和导入文件"""
     client = None
     max_retries = 3  # 最大重试次数
     retry_delay = CONFIG['connection_retry_base_delay']  # 基础重试间隔秒数
+    controller = get_block_controller()
     
     try:
+        memory_usage_before = psutil.Process().memory_info().rss / (1024 * 1024)
+        # 处理CSV文件
+        df = process_csv(file)
+        if df is None:
+            return {
+                'file': file,
+                'success': False,
+                'error': "Failed to process CSV",
+                'rows': 0,
+                'file_size_mb': 0,
+                'memory_delta_mb': 0,
+                'block_size': controller.block_size
+            }
+        
+        file_size = os.path.getsize(file) / (1024 * 1024)  # MB
+        row_count = len(df)
+        token = file_token(file)
+        inserted = 0
+        pending_rows = None
+        error = None
+        
         for attempt in range(1, max_retries + 1):
             try:
                 if client is None:
                     client = get_client()
-                
-                memory_usage_before = psutil.Process().memory_info().rss / (1024 * 1024)
-                # 处理CSV文件
-                df = process_csv(file)
-                if df is None:
-                    if client:
-                        client.close()
-                    return (file, False, "Failed to process CSV")
-                
-                file_size = os.path.getsize(file) / (1024 * 1024)  # MB
-                row_count = len(df)
-                success = True
-                chunk_size = CONFIG['batch_size']
-                
-                try:
-                    client.insert_df('api_metrics', df)
-                except Exception as e:
-                    # 如果批量插入失败，尝试分块插入
-                    success = True
-                    for chunk in chunk_dataframe(df, chunk_size):
-                        try:
-                            client.insert_df('api_metrics', chunk)
-                        except Exception as e:
-                            # 检查是否为Http Driver Exception或Broken pipe，若是则重建连接
-                            if 'Http Driver Exception' in str(e) or 'HTTP' in str(e) or 'Broken pipe' in str(e):
-                                if attempt < max_retries:
-                                    print(f"[批次{batch_id}][{file_index}/{BATCH_FILE_COUNT}][{file}] Http异常，第{attempt}次重试并重建连接...")
-                                    time.sleep(retry_delay * attempt)  # 指数退避策略
-                                    # 关闭旧连接
-                                    if client:
-                                        try:
-                                            client.close()
-                                        except:
-                                            pass
-                                    client = get_client()  # 强制重建连接
-                                    break  # 跳出for chunk，进入下一个attempt
-                                else:
-                                    success = False
-                                    print(f"[批次{batch_id}][{file_index}/{BATCH_FILE_COUNT}][{file}] Http异常，已达最大重试次数，放弃。")
-                                    break
-                            else:
-                                success = False
-                                print(f"Error importing chunk: {str(e)}")
-                                break
-                    if not success:
-                        break  # 跳出重试循环
-                
-                # 清理内存
-                del df
-                gc.collect()
-                
-                memory_usage_after = psutil.Process().memory_info().rss / (1024 * 1024)
-                result = {
-                    'file': file,
-                    'success': success,
-                    'error': None if success else "Import failed",
-                    'rows': row_count,
-                    'file_size_mb': file_size,
-                    'memory_delta_mb': memory_usage_after - memory_usage_before
-                }
-                
-                return result
-                
+                inserted = insert_adaptive(client, df, controller, token, inserted, pending_rows)
+                error = None
+                break
             except Exception as e:
-                # 检查是否为Http Driver Exception或Broken pipe，若是则重建连接
-                if 'Http Driver Exception' in str(e) or 'HTTP' in str(e) or 'Broken pipe' in str(e):
+                error = str(e)
+                inserted = getattr(e, 'inserted_offset', inserted)
+                pending_rows = getattr(e, 'pending_rows', None)
+                # 超时、连接异常或服务端繁忙时重建连接，并从已插入位置继续
+                if classify_insert_error(e) in ('timeout', 'connection', 'busy'):
                     if attempt < max_retries:
-                        print(f"[批次{batch_id}][{file_index}/{BATCH_FILE_COUNT}][{file}] Http异常，第{attempt}次重试并重建连接...")
+                        print(f"[{file_index}/{total_files}][{file}] Http异常，第{attempt}次重试并重建连接，当前块大小 {controller.block_size} 行...")
                         time.sleep(retry_delay * attempt)  # 指数退避策略
                         # 关闭旧连接
                         if client:
@@ -201,19 +415,40 @@ def import_file_process(file, batch_id=0, file_index=0):
                                 client.close()
                             except:
                                 pass
-                        client = get_client()  # 强制重建连接
+                        client = None  # 下次重试时重建连接
                         continue
                     else:
-                        print(f"[批次{batch_id}][{file_index}/{BATCH_FILE_COUNT}][{file}] Http异常，已达最大重试次数，放弃。")
-                        
-                return {
-                    'file': file,
-                    'success': False,
-                    'error': str(e),
-                    'rows': 0,
-                    'file_size_mb': 0,
-                    'memory_delta_mb': 0
-                }
+                        print(f"[{file_index}/{total_files}][{file}] Http异常，已达最大重试次数，放弃。")
+                else:
+                    print(f"Error importing chunk: {error}")
+                break
+        
+        success = error is None
+        
+        # 清理内存
+        del df
+        gc.collect()
+        
+        memory_usage_after = psutil.Process().memory_info().rss / (1024 * 1024)
+        return {
+            'file': file,
+            'success': success,
+            'error': None if success else f"Import failed after {inserted} rows: {error}",
+            'rows': row_count if success else inserted,
+            'file_size_mb': file_size,
+            'memory_delta_mb': memory_usage_after - memory_usage_before,
+            'block_size': controller.block_size
+        }
+    except Exception as e:
+        return {
+            'file': file,
+            'success': False,
+            'error': str(e),
+            'rows': 0,
+            'file_size_mb': 0,
+            'memory_delta_mb': 0,
+            'block_size': controller.block_size
+        }
     finally:
         # 确保连接关闭
         if client:
@@ -222,6 +457,225 @@ def import_file_process(file, batch_id=0, file_index=0):
             except:
                 pass
 
+def spool_paths():
+    """返回落盘缓冲的 pending / loading / failed 目录"""
+    pending_dir = os.path.join(CONFIG['spool_dir'], 'pending')
+    loading_dir = os.path.join(CONFIG['spool_dir'], 'loading')
+    failed_dir = os.path.join(CONFIG['spool_dir'], 'failed')
+    return pending_dir, loading_dir, failed_dir
+
+def spool_file_name(file):
+    """根据CSV路径、大小和修改时间生成缓冲文件名：<去重标识>.parquet
+
+    去重标识随文件大小和修改时间变化，同一路径重新导出修正后的内容时不会被服务端当作重复数据丢弃。
+    """
+    return f"{file_token(file)}_{os.path.splitext(os.path.basename(file))[0]}.parquet"
+
+def spool_file_process(file, file_index=0, total_files=0):
+    """作为单独进程解析CSV并写入本地Parquet缓冲文件，不依赖ClickHouse可用性"""
+    try:
+        memory_usage_before = psutil.Process().memory_info().rss / (1024 * 1024)
+        df = process_csv(file)
+        if df is None:
+            return {
+                'file': file,
+                'success': False,
+                'error': "Failed to process CSV",
+                'rows': 0,
+                'file_size_mb': 0,
+                'memory_delta_mb': 0
+            }
+        
+        file_size = os.path.getsize(file) / (1024 * 1024)  # MB
+        row_count = len(df)
+        pending_dir, _, _ = spool_paths()
+        target = os.path.join(pending_dir, spool_file_name(file))
+        # 先写临时文件再原子重命名，loader 只会看到完整的缓冲文件
+        tmp_target = target + '.tmp'
+        df.to_parquet(tmp_target, index=False)
+        os.replace(tmp_target, target)
+        
+        # 清理内存
+        del df
+        gc.collect()
+        
+        memory_usage_after = psutil.Process().memory_info().rss / (1024 * 1024)
+        return {
+            'file': file,
+            'success': True,
+            'error': None,
+            'rows': row_count,
+            'file_size_mb': file_size,
+            'memory_delta_mb': memory_usage_after - memory_usage_before
+        }
+    except Exception as e:
+        return {
+            'file': file,
+            'success': False,
+            'error': str(e),
+            'rows': 0,
+            'file_size_mb': 0,
+            'memory_delta_mb': 0
+        }
+
+def recover_spool():
+    """将上次崩溃时停留在 loading 目录的缓冲文件放回 pending，重新导入时依靠去重标识避免重复"""
+    pending_dir, loading_dir, failed_dir = spool_paths()
+    os.makedirs(pending_dir, exist_ok=True)
+    os.makedirs(loading_dir, exist_ok=True)
+    os.makedirs(failed_dir, exist_ok=True)
+    recovered = 0
+    for path in glob.glob(os.path.join(loading_dir, '*.parquet')):
+        os.replace(path, os.path.join(pending_dir, os.path.basename(path)))
+        recovered += 1
+    # 清理解析进程崩溃时遗留的半成品
+    for path in glob.glob(os.path.join(pending_dir, '*.tmp')):
+        os.remove(path)
+    if recovered:
+        print(f"已恢复 {recovered} 个未完成导入的缓冲文件")
+
+def spool_loader(parsing_done, stats, lock, error_log, index=0, count=1):
+    """从 pending 目录领取缓冲文件并批量导入，直到解析完成且缓冲区清空
+
+    服务端不可用时退避重试（最长 60 秒）；数据错误或被服务端拒绝的文件移入 failed 目录并写入错误日志。
+    """
+    import pyarrow.parquet as pq
+    pending_dir, loading_dir, failed_dir = spool_paths()
+    client = None
+    failures = 0
+    claim_queue = deque()  # 本轮列目录得到、尚未领取的文件
+    try:
+        while True:
+            # 通过原子重命名领取文件，多个 loader 线程不会重复导入同一文件
+            claimed = None
+            while claim_queue and claimed is None:
+                path = claim_queue.popleft()
+                loading_path = os.path.join(loading_dir, os.path.basename(path))
+                try:
+                    os.replace(path, loading_path)
+                except FileNotFoundError:
+                    continue  # 已被其他 loader 领取
+                claimed = loading_path
+            
+            if claimed is None:
+                # 每轮只列一次目录，按 loader 序号错开起始位置，避免所有 loader 争抢同一个文件
+                entries = [entry.path for entry in os.scandir(pending_dir) if entry.name.endswith('.parquet')]
+                if entries:
+                    start = len(entries) * index // count
+                    claim_queue = deque(entries[start:] + entries[:start])
+                    continue
+                if parsing_done.is_set():
+                    return
+                time.sleep(CONFIG['spool_poll_interval'])
+                continue
+            
+            file_name = os.path.basename(claimed)
+            token = os.path.splitext(file_name)[0]
+            try:
+                # 行数从 Parquet 元数据读取，不需要加载数据
+                rows = pq.read_metadata(claimed).num_rows
+                if client is None:
+                    client = get_client()
+                insert_file(
+                    client, 'api_metrics', claimed, fmt='Parquet',
+                    settings={
+                        'insert_deduplicate': 1,
+                        'insert_deduplication_token': token
+                    }
+                )
+                os.remove(claimed)
+                failures = 0
+                with lock:
+                    stats['loaded_files'] += 1
+                    stats['loaded_rows'] += rows
+            except Exception as e:
+                kind = classify_insert_error(e)
+                # 数据错误和服务端拒绝（内存、大小超限）与文件本身有关：整个文件按原样重试不会成功，
+                # 而拆分后各块的去重标识与整文件不同，崩溃恢复时无法去重，因此直接移入 failed 目录；
+                # 连接、超时、繁忙属于服务端可用性问题，无限重试
+                if kind in ('data', 'rejected'):
+                    # 无法通过重试解决的文件移入 failed 目录，loader 继续处理其他文件
+                    failed_path = os.path.join(failed_dir, file_name)
+                    os.replace(claimed, failed_path)
+                    with lock:
+                        stats['failed_files'] += 1
+                    with error_log_lock:
+                        error_log.write(f"缓冲文件导入错误 {failed_path}（{kind}）: {str(e)}\n")
+                        error_log.flush()
+                    print(f"缓冲文件导入失败 {failed_path}: {str(e)}，已移入 failed 目录")
+                    continue
+                
+                # 可重试的失败放回 pending，稍后重试，不影响解析进程
+                os.replace(claimed, os.path.join(pending_dir, file_name))
+                failures += 1
+                with lock:
+                    stats['load_errors'] += 1
+                print(f"缓冲文件导入失败 {claimed}: {str(e)}，{failures} 次连续失败，稍后重试")
+                if client:
+                    try:
+                        client.close()
+                    except:
+                        pass
+                    client = None
+                time.sleep(min(CONFIG['connection_retry_base_delay'] * failures, 60))
+    finally:
+        if client:
+            try:
+                client.close()
+            except:
+                pass
+
+# loader 线程与主线程共用错误日志时的写入锁
+error_log_lock = threading.Lock()
+
+def start_spool_loaders(parsing_done, error_log):
+    """启动缓冲文件导入线程，返回线程列表和共享统计"""
+    stats = {'loaded_files': 0, 'loaded_rows': 0, 'load_errors': 0, 'failed_files': 0}
+    lock = threading.Lock()
+    count = CONFIG['spool_loader_threads']
+    loaders = [
+        threading.Thread(target=spool_loader, args=(parsing_done, stats, lock, error_log, index, count), daemon=True)
+        for index in range(count)
+    ]
+    for loader in loaders:
+        loader.start()
+    return loaders, stats
+
+def has_pyarrow():
+    """检查落盘缓冲所需的 pyarrow 是否已安装"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("启用落盘缓冲需要安装 pyarrow: pip install pyarrow")
+        return False
+    return True
+
+def load_spool():
+    """单独运行 loader：导入缓冲区中已有的全部文件后退出，用于崩溃恢复"""
+    if not has_pyarrow():
+        return
+    create_table()
+    enable_insert_deduplication()
+    recover_spool()
+    parsing_done = threading.Event()
+    parsing_done.set()
+    os.makedirs('import_logs', exist_ok=True)
+    with open('import_logs/error.log', 'a', encoding='utf-8') as error_log:
+        loaders, stats = start_spool_loaders(parsing_done, error_log)
+        for loader in loaders:
+            loader.join()
+    print(f"缓冲区导入完成: 成功 {stats['loaded_files']} 个文件（{stats['loaded_rows']} 行），失败重试 {stats['load_errors']} 次，移入 failed 目录 {stats['failed_files']} 个")
+
+def get_pool_context():
+    """工作进程的启动方式
+
+    主进程中有 loader 线程和 tqdm 监控线程，直接 fork 可能让子进程继承被其他线程持有的锁
+    （stdout、urllib3 连接池等）而永久阻塞，因此改用 forkserver（不支持时用 spawn）。
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
 def count_csv_files():
     """统计CSV文件并返回路径列表"""
     csv_files = glob.glob(os.path.join(CSV_DIR, '**', '*明细.csv'), recursive=True)
@@ -243,9 +697,22 @@ def main():
             print("未找到CSV文件!")
             return
             
+        # 直接导入和落盘缓冲都依靠去重标识保证重试不重复写入
+        enable_insert_deduplication()
+        
+        if CONFIG['use_spool']:
+            if not has_pyarrow():
+                return
+            recover_spool()
+            worker = spool_file_process
+        else:
+            worker = import_file_process
+        
         # 添加用户确认步骤
-        print(f"将使用 {CONFIG['max_workers']} 个并行进程导入数据，每批 {CONFIG['batch_size']} 行，每批 {BATCH_FILE_COUNT} 个文件")
-        print(f"每批处理后休息 {CONFIG['batch_cooldown']} 秒，以释放连接资源")
+        if CONFIG['use_spool']:
+            print(f"将使用 {CONFIG['max_workers']} 个并行进程解析数据并写入缓冲目录 {CONFIG['spool_dir']}，由 {CONFIG['spool_loader_threads']} 个 loader 线程导入，最多 {CONFIG['max_in_flight']} 个文件同时在途")
+        else:
+            print(f"将使用 {CONFIG['max_workers']} 个并行进程导入数据，初始插入块 {load_block_size()} 行（自适应调整），最多 {CONFIG['max_in_flight']} 个文件同时在途")
         user_input = input("是否继续导入? (y/n): ").lower()
         if user_input != 'y':
             print("导入已被用户取消")
@@ -257,48 +724,65 @@ def main():
         success_count = 0
         error_count = 0
         total_rows = 0
+        total_files = len(csv_files)
+        block_sizes = {}  # 文件 -> 导入完成时工作进程的块大小
         
         # 创建日志文件
         success_log = open('import_logs/success.log', 'w', encoding='utf-8')
         error_log = open('import_logs/error.log', 'w', encoding='utf-8')
         stats_log = open('import_logs/stats.log', 'w', encoding='utf-8')
         
+        parsing_done = threading.Event()
+        if CONFIG['use_spool']:
+            loaders, spool_stats = start_spool_loaders(parsing_done, error_log)
+        # 落盘缓冲模式下工作进程只写入缓冲文件，是否导入 ClickHouse 由 loader 统计
+        success_label = '已写入缓冲' if CONFIG['use_spool'] else '成功导入'
+        
         try:
-            print(f"开始导入 {len(csv_files)} 个文件...")
+            print(f"开始导入 {total_files} 个文件...")
             
             # 添加总进度条
-            with tqdm(total=len(csv_files), desc="整体进度", bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {postfix}]') as total_pbar:
-                for batch_idx, i in enumerate(range(0, len(csv_files), BATCH_FILE_COUNT)):
-                    batch_files = csv_files[i:i+BATCH_FILE_COUNT]
-                    batch_start_time = time.time()
+            with tqdm(total=total_files, desc="整体进度", bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {postfix}]') as total_pbar:
+                # 整个导入过程只使用一个进程池，按完成顺序处理结果，避免慢文件阻塞后续结果处理
+                with ProcessPoolExecutor(max_workers=CONFIG['max_workers'], mp_context=get_pool_context()) as executor:
+                    file_iter = enumerate(csv_files)
+                    pending = {}
                     
-                    print(f"\n开始处理第 {batch_idx+1} 批次，共 {len(batch_files)} 个文件")
+                    def submit_next():
+                        """补充提交任务，直到在途任务数达到上限或文件已全部提交"""
+                        while len(pending) < CONFIG['max_in_flight']:
+                            try:
+                                idx, file = next(file_iter)
+                            except StopIteration:
+                                return
+                            future = executor.submit(worker, file, idx + 1, total_files)
+                            pending[future] = file
                     
-                    # 批次内的处理逻辑
-                    with ProcessPoolExecutor(max_workers=CONFIG['max_workers']) as executor:
-                        # 为每个文件提供批次索引和文件索引
-                        future_to_file = {executor.submit(import_file_process, file, batch_idx+1, idx+1): file 
-                                        for idx, file in enumerate(batch_files)}
-                        
-                        for idx, future in enumerate(tqdm(future_to_file, total=len(future_to_file), 
-                                                      desc=f"批次{batch_idx+1}进度", leave=False)):
+                    submit_next()
+                    while pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            file = pending.pop(future)
                             try:
                                 result = future.result()
                                 processed_files += 1
                                 total_pbar.update(1)
                                 
                                 if result['success']:
-                                    success_log.write(f"{result['file']} 成功导入，行数: {result['rows']}\n")
+                                    success_log.write(f"{result['file']} {success_label}，行数: {result['rows']}\n")
                                     success_log.flush()
                                     success_count += 1
                                     total_rows += result['rows']
                                 else:
                                     error_message = f"导入错误 {result['file']}: {result['error']}\n"
-                                    error_log.write(error_message)
-                                    error_log.flush()
+                                    with error_log_lock:
+                                        error_log.write(error_message)
+                                        error_log.flush()
                                     error_count += 1
                                     
-                                stats_log.write(f"{result['file']},{result['success']},{result['rows']},{result['file_size_mb']:.2f},{result['memory_delta_mb']:.2f}\n")
+                                if result.get('block_size'):
+                                    block_sizes[result['file']] = result['block_size']
+                                stats_log.write(f"{result['file']},{result['success']},{result['rows']},{result['file_size_mb']:.2f},{result['memory_delta_mb']:.2f},{result.get('block_size', '')}\n")
                                 stats_log.flush()
                                 
                                 elapsed_time = time.time() - start_time
@@ -308,25 +792,46 @@ def main():
                                 total_pbar.set_postfix({
                                     '速度': f'{files_per_second:.2f} 文件/秒',
                                     '行/秒': f'{rows_per_second:.0f}',
-                                    '成功': success_count,
+                                    success_label: success_count,
                                     '失败': error_count
                                 })
                             except Exception as e:
-                                print(f"处理结果时出错: {str(e)}")
-                    
-                    # 每个批次结束后的休息时间
-                    batch_time = time.time() - batch_start_time
-                    cool_down = CONFIG['batch_cooldown']
-                    print(f"\n批次 {batch_idx+1} 完成，处理时间: {batch_time:.2f} 秒，休息 {cool_down} 秒以释放连接资源...")
-                    time.sleep(cool_down)
-                    
-                    # 主动触发垃圾回收
-                    gc.collect()
+                                print(f"处理结果时出错 {file}: {str(e)}")
+                        
+                        # 有任务完成后立即补充新任务，保持进程池持续满载
+                        submit_next()
+            
+            # 解析完成后等待 loader 清空缓冲区
+            if CONFIG['use_spool']:
+                parsing_done.set()
+                print("解析完成，等待缓冲文件导入...")
+                for loader in loaders:
+                    loader.join()
+                print(f"缓冲文件导入完成: 成功 {spool_stats['loaded_files']} 个文件（{spool_stats['loaded_rows']} 行），失败重试 {spool_stats['load_errors']} 次，移入 failed 目录 {spool_stats['failed_files']} 个")
             
             # 计算总耗时
             total_time = time.time() - start_time
             
-            print(f"""
+            # 以各进程最终块大小的中位数作为下次运行的初始块大小
+            if block_sizes:
+                tuned_block_size = int(np.median(list(block_sizes.values())))
+                save_block_size(tuned_block_size)
+                print(f"调优后的插入块大小: {tuned_block_size} 行，已保存到 {CONFIG['block_size_state_file']}")
+            
+            if CONFIG['use_spool']:
+                print(f"""
+            导入完成:
+            - 总文件数: {len(csv_files)}
+            - 写入缓冲: {success_count} 个文件，{total_rows} 行
+            - 导入 ClickHouse: {spool_stats['loaded_files']} 个文件，{spool_stats['loaded_rows']} 行
+            - 解析失败: {error_count}
+            - 导入失败（见 {CONFIG['spool_dir']}/failed）: {spool_stats['failed_files']}
+            - 总耗时: {total_time:.2f} 秒
+            - 平均速度: {len(csv_files)/total_time:.2f} 文件/秒
+            - 数据导入速度: {spool_stats['loaded_rows']/total_time:.2f} 行/秒
+            """)
+            else:
+                print(f"""
             导入完成:
             - 总文件数: {len(csv_files)}
             - 成功导入: {success_count}
@@ -350,4 +855,8 @@ def main():
 CSV_DIR = r'/home/clickhouse/test/data'  # 使用原始字符串标记
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # python import.py load-spool：只导入缓冲区中已有的文件
+    if len(sys.argv) > 1 and sys.argv[1] == 'load-spool':
+        load_spool()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,126 @@
+from clickhouse_connect import get_client
+import pandas as pd
+import argparse
+from datetime import datetime, timedelta
+
+# 支持的时间粒度 -> ClickHouse 时间截断函数
+INTERVALS = {
+    'minute': 'toStartOfMinute',
+    'hour': 'toStartOfHour',
+    'day': 'toStartOfDay',
+}
+
+def create_client():
+    try:
+        # 创建客户端连接
+        client = get_client(
+            host='localhost',
+            port=8123,  # 使用 HTTP 接口
+            username='default',
+            password='yourpassword'
+        )
+        return client
+    except Exception as e:
+        print(f"连接失败: {e}")
+        raise
+
+def build_query(endpoint, interval):
+    # 过滤条件与投影 proj_service_endpoint 的排序键一致，
+    # endpoint 单独过滤时由 bloom_filter 跳数索引裁剪 granule
+    conditions = ['service_name = {service:String}']
+    if endpoint is not None:
+        conditions.append('endpoint = {endpoint:String}')
+    conditions += ['timestamp >= {start:DateTime}', 'timestamp < {end:DateTime}']
+
+    # 先按分钟汇总得到每分钟请求量，再按粒度取峰值分钟，保证 hour/day 粒度下仍是 CPM
+    return f'''
+    WITH minute_stats AS (
+        SELECT
+            toStartOfMinute(timestamp) as minute,
+            sum(cpm) as minute_cpm,
+            quantilesState(0.5, 0.9, 0.99)(latency) as latency_state
+        FROM api_metrics
+        WHERE {' AND '.join(conditions)}
+        GROUP BY minute
+    )
+    SELECT
+        {INTERVALS[interval]}(minute) as bucket,
+        max(minute_cpm) as peak_cpm,
+        quantilesMerge(0.5, 0.9, 0.99)(latency_state) as latency_quantiles,
+        latency_quantiles[1] as p50,
+        latency_quantiles[2] as p90,
+        latency_quantiles[3] as p99
+    FROM minute_stats
+    GROUP BY bucket
+    ORDER BY bucket
+    '''
+
+def get_drilldown(service, endpoint, start, end, interval, explain=False):
+    client = create_client()
+
+    query = build_query(endpoint, interval)
+    parameters = {'service': service, 'start': start, 'end': end}
+    if endpoint is not None:
+        parameters['endpoint'] = endpoint
+
+    try:
+        if explain:
+            # 显示索引和投影裁剪后实际读取的 part / granule 数量
+            plan = client.query(f'EXPLAIN indexes = 1, projections = 1 {query}', parameters=parameters)
+            print("\n查询计划：")
+            for row in plan.result_rows:
+                print(row[0])
+
+        result = client.query(query, parameters=parameters)
+    finally:
+        client.close()
+
+    # 转换为DataFrame
+    df = pd.DataFrame(result.result_rows, columns=[
+        'bucket', 'peak_cpm', 'latency_quantiles', 'p50', 'p90', 'p99'
+    ]).drop(columns=['latency_quantiles'])
+
+    return df
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='按服务或接口下钻统计峰值 CPM 和延迟分位数')
+    parser.add_argument('service', help='服务名称 (service_name)')
+    parser.add_argument('--endpoint', help='接口 (endpoint)，不指定时统计整个服务')
+    parser.add_argument('--start', help='开始时间，格式 YYYY-MM-DD HH:MM，默认结束时间前 24 小时')
+    parser.add_argument('--end', help='结束时间，格式 YYYY-MM-DD HH:MM，默认当前时间')
+    parser.add_argument('--interval', choices=list(INTERVALS), default='hour', help='统计粒度，默认 hour')
+    parser.add_argument('--explain', action='store_true', help='打印查询计划，查看索引和投影的裁剪效果')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    try:
+        end = datetime.strptime(args.end, '%Y-%m-%d %H:%M') if args.end else datetime.now()
+        start = datetime.strptime(args.start, '%Y-%m-%d %H:%M') if args.start else end - timedelta(days=1)
+
+        target = args.service if args.endpoint is None else f"{args.service} {args.endpoint}"
+        print(f"开始下钻统计 {target}，时间范围 {start:%Y-%m-%d %H:%M} ~ {end:%Y-%m-%d %H:%M}...")
+
+        # 获取统计数据
+        df = get_drilldown(args.service, args.endpoint, start, end, args.interval, args.explain)
+        if df.empty:
+            print("指定时间范围内没有数据")
+            return
+
+        # 打印统计结果
+        print("\n下钻统计结果：")
+        print("=" * 80)
+        print(f"{'时间':<22} {'峰值CPM':<12} {'P50延迟':<12} {'P90延迟':<12} {'P99延迟':<12}")
+        print("-" * 80)
+
+        for _, row in df.iterrows():
+            print(f"{row['bucket'].strftime('%Y-%m-%d %H:%M:%S'):<22} {row['peak_cpm']:<12.2f} {row['p50']:<12.2f} {row['p90']:<12.2f} {row['p99']:<12.2f}")
+
+        print("=" * 80)
+        print(f"峰值CPM: {df['peak_cpm'].max():.2f}，P99延迟最大值: {df['p99'].max():.2f}")
+
+    except Exception as e:
+        print(f"统计过程中发生错误: {str(e)}")
+
+if __name__ == "__main__":
+    main()
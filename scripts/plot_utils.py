@@ -0,0 +1,63 @@
+import os
+from functools import lru_cache
+
+# 可能的中文字体文件路径 - 根据系统上实际安装的字体
+FONT_PATHS = [
+    # Noto Sans CJK 字体路径
+    '/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/google-noto-cjk/NotoSansCJK-Medium.ttc',
+    '/usr/share/fonts/google-noto-cjk/NotoSansCJK-Bold.ttc',
+
+    # CESI 字体路径
+    '/usr/share/fonts/cesi/CESI_HT_GB18030.TTF',
+    '/usr/share/fonts/cesi/CESI_SS_GB18030.TTF',
+    '/usr/share/fonts/cesi/CESI_KT_GB18030.TTF',
+
+    # Droid Sans Fallback
+    '/usr/share/fonts/google-droid-fonts/DroidSansFallback.ttf',
+]
+
+# 未找到字体文件时按名称设置 - 基于系统已安装的字体
+FONT_NAMES = [
+    'Noto Sans CJK SC',  # 首选思源黑体简体中文
+    'CESI黑体-GB18030',   # CESI黑体
+    'CESI宋体-GB18030',   # CESI宋体
+    'Droid Sans Fallback' # 备用
+]
+
+# 图表分辨率，300 dpi 渲染耗时明显更长，屏幕查看 150 dpi 已足够
+DEFAULT_DPI = 150
+
+@lru_cache(maxsize=None)
+def find_cjk_font():
+    """查找第一个存在的中文字体文件，结果在进程内缓存"""
+    for path in FONT_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+def get_pyplot():
+    """按需加载 matplotlib，使用无界面的 Agg 后端"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def setup_font(font_path=None):
+    """配置中文字体，返回用于标题和标签的字体参数
+
+    font_path 为 None 时在当前进程内查找字体文件。
+    """
+    plt = get_pyplot()
+    plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
+
+    if font_path is None:
+        font_path = find_cjk_font()
+    if font_path:
+        # 找到字体文件时直接使用FontProperties
+        from matplotlib.font_manager import FontProperties
+        return {'fontproperties': FontProperties(fname=font_path)}
+
+    # 没有找到字体文件，回退到按名称设置字体
+    plt.rcParams['font.sans-serif'] = FONT_NAMES
+    return {}
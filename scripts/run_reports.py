@@ -0,0 +1,105 @@
+from clickhouse_connect import get_client
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+import time
+import multiprocessing
+from daily_max_cpm import get_daily_max_cpm, print_daily_max_cpm, plot_daily_max_cpm
+from time_stats import get_top_10_by_timestamp, print_time_series_top_10, plot_time_series_top_10
+from plot_utils import DEFAULT_DPI, find_cjk_font, get_pyplot
+
+# 每日报告：名称 -> (查询函数, 打印函数, 绘图函数)
+REPORTS = {
+    '每日最大请求量': (get_daily_max_cpm, print_daily_max_cpm, plot_daily_max_cpm),
+    '时间序列 Top 10 CPM': (get_top_10_by_timestamp, print_time_series_top_10, plot_time_series_top_10),
+}
+
+def create_shared_client():
+    try:
+        # 创建客户端连接，关闭会话ID以便多个线程在同一客户端上并发查询
+        client = get_client(
+            host='localhost',
+            port=8123,  # 使用 HTTP 接口
+            username='default',
+            password='yourpassword',
+            autogenerate_session_id=False
+        )
+        return client
+    except Exception as e:
+        print(f"连接失败: {e}")
+        raise
+
+def warm_up():
+    """空任务，用于提前启动绘图进程"""
+    return None
+
+def create_plot_pool():
+    # forkserver/spawn 每个进程都要重新导入 pandas 和 matplotlib，比画图本身还慢，因此只用 fork；
+    # 不支持 fork 的平台返回 None，直接在主进程内绘图
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    # 先在主进程导入 matplotlib，fork 出的绘图进程直接继承，不必各自再导入一遍
+    get_pyplot()
+    pool = ProcessPoolExecutor(max_workers=len(REPORTS), mp_context=multiprocessing.get_context('fork'))
+    # fork 方式下首次提交任务时会一次性启动全部进程，此时还没有查询线程，fork 是安全的
+    pool.submit(warm_up).result()
+    return pool
+
+def submit_plot(plot_pool, plot_report, df, font_path):
+    # 有绘图进程时异步绘图，否则在主进程内直接绘图
+    if plot_pool is not None:
+        return plot_pool.submit(plot_report, df, font_path, DEFAULT_DPI)
+    future = Future()
+    try:
+        future.set_result(plot_report(df, font_path, DEFAULT_DPI))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def main():
+    start_time = time.time()
+    plot_pool = None
+    try:
+        print(f"开始生成 {len(REPORTS)} 个报告...")
+
+        # 字体只在主进程查找一次，绘图进程直接使用结果
+        font_path = find_cjk_font()
+        print(f"使用字体文件: {font_path}" if font_path else "未找到中文字体文件，将按字体名称设置")
+
+        # 绘图进程必须在创建客户端和查询线程之前启动
+        plot_pool = create_plot_pool()
+
+        client = create_shared_client()
+        try:
+            with ThreadPoolExecutor(max_workers=len(REPORTS)) as query_pool:
+                # 并发执行所有查询
+                query_futures = {name: query_pool.submit(query, client) for name, (query, _, _) in REPORTS.items()}
+
+                # 按报告顺序打印结果，并将绘图交给绘图进程
+                plot_futures = {}
+                for name, (_, print_report, plot_report) in REPORTS.items():
+                    try:
+                        df = query_futures[name].result()
+                    except Exception as e:
+                        print(f"{name} 查询失败: {str(e)}")
+                        continue
+                    print_report(df)
+                    plot_futures[name] = submit_plot(plot_pool, plot_report, df, font_path)
+
+                print("\n正在生成统计图表...")
+                for name, future in plot_futures.items():
+                    try:
+                        print(f"{name} 图表已保存为 {future.result()}")
+                    except Exception as e:
+                        print(f"{name} 图表生成失败: {str(e)}")
+        finally:
+            client.close()
+
+        print(f"\n全部报告完成，耗时 {time.time() - start_time:.2f} 秒")
+
+    except Exception as e:
+        print(f"生成报告过程中发生错误: {str(e)}")
+    finally:
+        if plot_pool is not None:
+            plot_pool.shutdown()
+
+if __name__ == "__main__":
+    main()